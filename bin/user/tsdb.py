@@ -6,18 +6,91 @@ import weewx
 from weewx.engine import StdService
 import sqlite3
 import psycopg2
+from psycopg2 import sql
+from psycopg2.extras import execute_values
 import logging
 import time
-import os
+import io
+import csv
+import struct
+import queue
+import threading
+import urllib.parse
 
 VERSION = "0.1"
 WEEWX_VERSION = "4"
 
+def _to_copy_int(value):
+    """Convert a value for an integer COPY field, raise ValueError instead of truncating a fraction."""
+    if isinstance(value, float) and not value.is_integer():
+        raise ValueError(f"{value} is not an integer")
+    return int(value)
+
+# struct formats and Python conversions for binary COPY, keyed on the postgres data type
+PG_BINARY_TYPES = {
+    'smallint': ('h', _to_copy_int),
+    'integer': ('i', _to_copy_int),
+    'bigint': ('q', _to_copy_int),
+    'real': ('f', float),
+    'double precision': ('d', float),
+}
+PG_COPY_SIGNATURE = b'PGCOPY\n\xff\r\n\x00'
+# WeeWX columns stored as INTEGER in TimescaleDB, all other columns are measurements
+TSDB_INTEGER_COLUMNS = frozenset(['dateTime', 'usUnits', 'interval', 'mintime', 'maxtime', 'count', 'sumtime'])
+# Epoch times and daily sums need more than the 24 bit mantissa of REAL
+TSDB_DOUBLE_COLUMNS = frozenset(['sunrise', 'sunset', 'sum', 'wsum'])
+TSDB_MEASUREMENT_TYPE = 'REAL'
+# Rows read from SQLite and sent to TimescaleDB per batch, bounds memory during a backlog sync
+FETCH_BATCH_SIZE = 5000
+# Archive records the background worker coalesces into one sync pass
+WORKER_BATCH_SIZE = 1000
+# Seconds shutDown() waits for the worker to finish its current batch
+WORKER_STOP_TIMEOUT = 10
+# Smaller batches skip the staging table and go straight into one multi-row INSERT
+COPY_MIN_ROWS = 100
+# Hypertable chunk sizes in seconds, about 2000 archive records at 5 minutes and ten years of days
+TSDB_ARCHIVE_CHUNK_INTERVAL = 7 * 86400
+TSDB_DAILY_CHUNK_INTERVAL = 3650 * 86400
+# Continuous aggregate policy: refresh window start in seconds before now and schedule
+CAGG_START_OFFSET = 3 * 86400
+CAGG_SCHEDULE_INTERVAL = 3600
+# Session advisory lock serializing the TimescaleDB schema setup
+TSDB_INIT_LOCK_ID = 4242
+# Daily archive tables we want to sync
+DAILY_ARCHIVE_TABLES = (
+    "archive_day_altimeter", "archive_day_appTemp1", "archive_day_barometer",
+    "archive_day_cloudBase", "archive_day_dewpoint", "archive_day_ET", "archive_day_heatindex",
+    "archive_day_humidex", "archive_day_inDewpoint", "archive_day_inHumidity", "archive_day_inTemp",
+    "archive_day_outHumidity", "archive_day_outTemp", "archive_day_pressure", "archive_day_rain",
+    "archive_day_rainRate", "archive_day_windChill", "archive_day_windDir", "archive_day_windGust",
+    "archive_day_windGustDir", "archive_day_windRun", "archive_day_windSpeed"
+)
+# Columns in the archive table we want to sync
+ARCHIVE_COLUMNS = (
+    "dateTime", "usUnits", "interval", "altimeter", "appTemp", "appTemp1", "barometer",
+    "batteryStatus1", "batteryStatus2", "cloudBase", "co", "co2", "consBatteryVoltage", "dewpoint",
+    "ET", "extraHumid1", "extraHumid2", "extraTemp1", "extraTemp2", "forecast", "hail", "hailRate",
+    "heatindex", "heatIndex1", "heatingTemp", "heatingVoltage", "humIndex", "humIndex1", "inDewpoint",
+    "inHumidity", "inTemp", "leafTemp1", "leafTemp2", "leafWet1", "leafWet2", "lightningDistance",
+    "lightningDisturberCount", "lightningEnergy", "lightningNoiseCount", "lightningStrikeCount",
+    "luminosity", "maxSolarRad", "nh3", "no2", "noise", "o3", "outHumidity", "outTemp", "pb", "pm10",
+    "pm1", "pm2_5", "pressure", "radiation", "rain", "rainRate", "rxCheckPercent", "snow", "snowDepth",
+    "snowMoisture", "snowRate", "so2", "soilMoist1", "soilMoist2", "soilTemp1", "soilTemp2",
+    "txBatteryStatus", "uv", "windChill", "windDir", "windGust", "windGustDir", "windRun", "windSpeed",
+    "highOutTemp", "lowOutTemp", "forecastRule", "windSpeed10", "dayRain", "monthRain", "yearRain",
+    "stormRain", "dayET", "monthET", "yearET", "forecastIcon", "sunrise", "sunset", "wind_samples"
+)
+# Columns of the WeeWX daily summary tables
+DAILY_ARCHIVE_COLUMNS = (
+    "dateTime", "min", "mintime", "max", "maxtime", "sum", "count", "wsum", "sumtime"
+)
+
 if weewx.__version__ < WEEWX_VERSION:
     raise weewx.UnsupportedFeature("weewx %s or greater is required, found %s"
                                    % (WEEWX_VERSION, weewx.__version__))
 
 import weeutil.logger
+from weeutil.weeutil import to_bool, to_int
 log = logging.getLogger(__name__)
 
 class TimescaleDBSync(StdService):
@@ -27,30 +100,22 @@ class TimescaleDBSync(StdService):
         """Initialize the TimescaleDB service."""
         super().__init__(engine, config_dict)
 
-        # daily archive tables we want to sync
-        self.daily_archive_tables = [
-            "archive_day_altimeter", "archive_day_appTemp1", "archive_day_barometer",
-            "archive_day_cloudBase", "archive_day_dewpoint", "archive_day_ET", "archive_day_heatindex",
-            "archive_day_humidex", "archive_day_inDewpoint", "archive_day_inHumidity", "archive_day_inTemp",
-            "archive_day_outHumidity", "archive_day_outTemp", "archive_day_pressure", "archive_day_rain",
-            "archive_day_rainRate", "archive_day_windChill", "archive_day_windDir", "archive_day_windGust",
-            "archive_day_windGustDir", "archive_day_windRun", "archive_day_windSpeed"
-        ]
-        # Columns in the archive table we want to sync, adjustable before postgres tsdb initialization
-        self.archive_columns = [
-            "dateTime", "usUnits", "interval", "altimeter", "appTemp", "appTemp1", "barometer", 
-            "batteryStatus1", "batteryStatus2", "cloudBase", "co", "co2", "consBatteryVoltage", "dewpoint", 
-            "ET", "extraHumid1", "extraHumid2", "extraTemp1", "extraTemp2", "forecast", "hail", "hailRate", 
-            "heatindex", "heatIndex1", "heatingTemp", "heatingVoltage", "humIndex", "humIndex1", "inDewpoint", 
-            "inHumidity", "inTemp", "leafTemp1", "leafTemp2", "leafWet1", "leafWet2", "lightningDistance", 
-            "lightningDisturberCount", "lightningEnergy", "lightningNoiseCount", "lightningStrikeCount", 
-            "luminosity", "maxSolarRad", "nh3", "no2", "noise", "o3", "outHumidity", "outTemp", "pb", "pm10", 
-            "pm1", "pm2_5", "pressure", "radiation", "rain", "rainRate", "rxCheckPercent", "snow", "snowDepth", 
-            "snowMoisture", "snowRate", "so2", "soilMoist1", "soilMoist2", "soilTemp1", "soilTemp2", 
-            "txBatteryStatus", "uv", "windChill", "windDir", "windGust", "windGustDir", "windRun", "windSpeed",
-            "highOutTemp", "lowOutTemp", "forecastRule", "windSpeed10", "dayRain", "monthRain", "yearRain", 
-            "stormRain", "dayET", "monthET", "yearET", "forecastIcon", "sunrise", "sunset", "wind_samples"
-        ]
+        # Tables and columns to sync, adjustable before postgres tsdb initialization
+        self.daily_archive_tables = DAILY_ARCHIVE_TABLES
+        self.archive_columns = ARCHIVE_COLUMNS
+        self.daily_archive_columns = DAILY_ARCHIVE_COLUMNS
+        # SQLite queries for the next batch of rows of each daily table, the same on every pass
+        self._daily_select_sql = {
+            table: f"""
+                SELECT {','.join(self.daily_archive_columns)} FROM {table}
+                WHERE dateTime > ?
+                ORDER BY dateTime ASC
+                LIMIT ?
+            """
+            for table in self.daily_archive_tables
+        }
+        # Subset of archive_columns present in the WeeWX archive table, resolved on first use
+        self._archive_select_columns = None
         
         # Get configuration
         try:
@@ -59,217 +124,491 @@ class TimescaleDBSync(StdService):
             self.database = config_dict['TimescaleDBSync'].get('database', 'weather_data_test')
             self.user = config_dict['TimescaleDBSync'].get('user', 'postgres')
             self.password = config_dict['TimescaleDBSync'].get('password', '')
-            self.enable_daily_sync = config_dict['TimescaleDBSync'].get('enable_daily_sync', False)
+            self.enable_daily_sync = to_bool(config_dict['TimescaleDBSync'].get('enable_daily_sync', False))
+            # Let TimescaleDB compute the daily summaries from the archive hypertable instead of copying them
+            self.enable_continuous_aggregates = to_bool(config_dict['TimescaleDBSync'].get('enable_continuous_aggregates', False))
+            # Without waiting for the WAL flush a commit costs one round-trip, on a server
+            # crash the last few hundred milliseconds of commits can be lost; they are synced
+            # again because the watermarks are re-read from TimescaleDB after reconnecting
+            self.synchronous_commit = config_dict['TimescaleDBSync'].get('synchronous_commit', 'off')
+            # Archive chunks older than this many days are compressed by TimescaleDB, 0 disables it
+            # A typo falls back to the default instead of keeping WeeWX from starting
+            try:
+                self.compress_after_days = int(to_int(config_dict['TimescaleDBSync'].get('compress_after_days', 7)))
+            except (TypeError, ValueError) as e:
+                log.error(f"Invalid compress_after_days, using 7: {e}")
+                self.compress_after_days = 7
             self.tsdb_config = {
                 'host': self.host,
                 'port': self.port,
                 'database': self.database,
                 'user': self.user,
-                'password': self.password
+                'password': self.password,
+                'options': f"-c synchronous_commit={self.synchronous_commit}"
             }
         except KeyError as e:
             log.info(f"Missing TimescaleDB configuration: %s", e)
             
+        # Continuous aggregate views replacing the daily tables, mapped to their archive column
+        self.continuous_aggregates = {
+            f"{table}_cagg": table[len("archive_day_"):] for table in self.daily_archive_tables
+            if table[len("archive_day_"):] in self.archive_columns
+        }
+
+        # Long-lived TimescaleDB connection, opened lazily by _get_tsdb_conn()
+        self.tsdb_conn = None
+        # Long-lived SQLite connection, opened lazily on the worker thread
+        self.weewx_conn = None
+        # Newest dateTime already in TimescaleDB, read from the tables on the first pass
+        self._archive_watermark = None
+        self._daily_watermarks = {}
+        # Oldest copied dateTime the continuous aggregates have not been refreshed for
+        self._cagg_refresh_start = None
+        # TimescaleDB tables known to exist, so DDL is issued at most once per table
+        self._ensured_tables = set()
+        # INSERT, COPY and upsert statements keyed on table and columns, composed once per layout
+        self._insert_sql_cache = {}
+        self._copy_sql_cache = {}
+        self._upsert_sql_cache = {}
+        # Temporary staging tables created on the current TimescaleDB connection
+        self._staging_tables = set()
+        # Postgres data types of the TimescaleDB tables, looked up on the first COPY
+        self._tsdb_column_types = {}
+
         # Initialize paths and dataset
         try:
             db = config_dict['DataBindings']['wx_binding']['database']
             db_path = f"/var/lib/weewx/{config_dict['Databases'][db]['database_name']}"
             self.weewx_db_path = db_path
-            self.sync_db_path = f"/var/lib/weewx/syncTsdb.sdb"
-            # Initialize synchronization DB and postgres ts database
-            self._init_sync_db()
+            # Initialize postgres ts database
+            self._init_tsdb()
         except Exception as e:
             log.error(f"Error initialization: {e}")
         else:
+            # Synchronization runs on a worker thread so the engine is never blocked by TimescaleDB
+            self._queue = queue.Queue()
+            # Set when shutDown() stops waiting, the sync loops return after the current batch
+            self._stop = threading.Event()
+            self._worker_thread = threading.Thread(target=self._worker, name='TimescaleDBSync', daemon=True)
+            self._worker_thread.start()
             self.bind(weewx.NEW_ARCHIVE_RECORD, self.new_archive_record)
 
     def new_archive_record(self, event):
-        """Gets called on a new archive record event."""
-        record = event.record
-        
-        # Synchronize to TimescaleDB
-        try:
-            self.tsdb_conn = psycopg2.connect(**self.tsdb_config)
-            self._insert_tsdb("archive", record)
-            # Mark this new record as synced in the sync DB
-            sconn = sqlite3.connect(self.sync_db_path)
-            scur = sconn.cursor()
-            scur.execute("INSERT OR REPLACE INTO synced_archive (dateTime, synced) VALUES (?, 1)", (record.get('dateTime'),))
-            sconn.commit()
-            scur.close()
-            sconn.close()
-        except Exception as e:
-            log.error(f"Error synchronizing TimescaleDB archive: %s", e)
-        finally:
-            if hasattr(self, 'tsdb_conn'):
-                self.tsdb_conn.close()
-
-        # Check for older records in the weewx database that haven't been synchronized yet
+        """Gets called on a new archive record event, hands a copy of the record to the worker thread."""
+        # Other services may still change the engine's record after this handler returns
+        self._queue.put(dict(event.record))
+
+    def _worker(self):
+        """Drain queued archive records and synchronize them until shutDown() queues None."""
+        while True:
+            records = [self._queue.get()]
+            # Coalesce records that queued up while the previous pass was running
+            while len(records) < WORKER_BATCH_SIZE:
+                try:
+                    records.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in records
+            records = [record for record in records if record is not None]
+            if records:
+                try:
+                    self._sync_records(records)
+                except Exception as e:
+                    log.error(f"Error in TimescaleDB sync worker: {e}")
+            if stop or self._stop.is_set():
+                break
+        self._close_weewx_conn()
+        # The worker owns the TimescaleDB connection, it is closed here and not under a running pass
+        if self.tsdb_conn is not None:
+            self.tsdb_conn.close()
+            self.tsdb_conn = None
+
+    def _sync_records(self, records):
+        """Synchronize the backlog, new archive records and the daily archives."""
+        # Check for records in the weewx database newer than the TimescaleDB watermark
+        caught_up = False
         try:
-            self.weewx_conn = sqlite3.connect(self.weewx_db_path)
-            cursor = self.weewx_conn.cursor()
-
-            # Attach sync database to allow cross-database queries
-            cursor.execute(f"ATTACH DATABASE '{self.sync_db_path}' AS sync_db")
-
-            # Select only records that are NOT in the synced_archive table
-            # This avoids loading the entire archive table into memory
-            cursor.execute("""
-                SELECT * FROM archive 
-                WHERE dateTime NOT IN (SELECT dateTime FROM sync_db.synced_archive WHERE synced = 1)
+            # A lost connection is reopened before the watermark is used, not in the middle of the pass
+            self._get_tsdb_conn()
+            watermark = self._get_archive_watermark()
+            cursor = self._get_weewx_conn().cursor()
+
+            # Only the columns we want to insert are selected, rows come back in that order
+            columns = self._get_archive_select_columns(cursor)
+            query = f"""
+                SELECT {','.join(columns)} FROM archive 
+                WHERE dateTime > ?
                 ORDER BY dateTime ASC
-            """)
-            rows = cursor.fetchall()
-
-            if rows:
-                columns = [description[0] for description in cursor.description]
-                # filter columns that we want to insert
-                filtered_columns = [col for col in columns if col in self.archive_columns]
+                LIMIT ?
+            """
+            dt_pos = columns.index('dateTime')
 
-                # Open connections once for the batch
-                try:
-                    self.tsdb_conn = psycopg2.connect(**self.tsdb_config)
-                    sconn = sqlite3.connect(self.sync_db_path)
-                    scur = sconn.cursor()
-                    for row in rows:
-                        filtered_row = [row[columns.index(col)] for col in filtered_columns]
-                        old_record = dict(zip(filtered_columns, filtered_row))
-                        dt = old_record['dateTime']
-
-                        try:
-                            self._insert_tsdb("archive", old_record)
-                            # Mark as synced in sync DB
-                            scur.execute("INSERT OR REPLACE INTO synced_archive (dateTime, synced) VALUES (?, 1)", (dt,))
-                        except Exception as e:
-                            log.error(f"Error syncing older record {dt} to TimescaleDB: %s", e)
-
-                    sconn.commit()
-                    scur.close()
-                    sconn.close()
-                except Exception as e:
-                    log.error(f"Error during batch sync to TimescaleDB: %s", e)
-                finally:
-                    if hasattr(self, 'tsdb_conn'):
-                        self.tsdb_conn.close()
+            # Read the backlog in batches, each batch is sent to TimescaleDB with a single COPY
+            # and committed, the watermark only moves past rows that are in TimescaleDB
+            try:
+                for rows in self._read_weewx_batches(cursor, query, watermark, dt_pos):
+                    self._copy_tsdb("archive", columns, rows)
+                    self._archive_watermark = rows[-1][dt_pos]
+                    if self.enable_continuous_aggregates and self._cagg_refresh_start is None:
+                        self._cagg_refresh_start = rows[0][dt_pos]
+            finally:
+                cursor.close()
+            # A pass stopped by shutDown() has not caught up
+            caught_up = not self._stop.is_set()
 
         except Exception as e:
             log.error(f"Error synchronizing old records: %s", e)
-        finally:
-            if hasattr(self, 'weewx_conn'):
-                self.weewx_conn.close()
 
-        # Check daily archives if enabled
-        if self.enable_daily_sync:
+        # Also after a failed pass, batches committed before the failure need their refresh
+        if self._cagg_refresh_start is not None:
+            self._refresh_pending_aggregates()
+
+        # Records WeeWX has not stored yet are inserted directly, only after a complete
+        # backlog pass so the watermark never skips a gap; the unique dateTime index
+        # drops a record that is already there
+        if caught_up:
+            try:
+                pending = [record for record in records if record.get('dateTime') > self._archive_watermark]
+                if pending:
+                    self._insert_tsdb("archive", pending)
+            except Exception as e:
+                log.error(f"Error synchronizing TimescaleDB archive: %s", e)
+
+        # Check daily archives if enabled, continuous aggregates replace them
+        if self.enable_daily_sync and not self.enable_continuous_aggregates and not self._stop.is_set():
             log.info(f"Daily archive sync is {'enabled' if self.enable_daily_sync else 'disabled'}.")
             self._sync_daily_archives()
 
 
-    def _insert_tsdb(self, table, record):
-        cur = self.tsdb_conn.cursor()
+    def shutDown(self):
+        """Stop the worker after its current batch, then close the TimescaleDB connection."""
+        if hasattr(self, '_worker_thread'):
+            # Records not yet in TimescaleDB are in the WeeWX database, the next start
+            # syncs them from the watermark
+            self._queue.put(None)
+            self._stop.set()
+            self._worker_thread.join(timeout=WORKER_STOP_TIMEOUT)
+            if self._worker_thread.is_alive():
+                # Closing the connection under the worker would break its open transaction
+                log.error("TimescaleDB sync worker did not stop, leaving its connection open")
+                return
+        if self.tsdb_conn is not None:
+            self.tsdb_conn.close()
+            self.tsdb_conn = None
+
+    def _get_tsdb_conn(self):
+        """Return the shared TimescaleDB connection, reconnecting if it was closed or lost."""
+        if self.tsdb_conn is None or self.tsdb_conn.closed:
+            self.tsdb_conn = psycopg2.connect(**self.tsdb_config)
+            # Temporary tables do not survive the old connection
+            self._staging_tables.clear()
+            # With synchronous_commit off a server crash can lose commits that were already
+            # acknowledged, the watermarks are read again from what TimescaleDB really has
+            self._archive_watermark = None
+            self._daily_watermarks.clear()
+        return self.tsdb_conn
+
+    def _get_tsdb_max_datetime(self, table, end_transaction=True):
+        """Return the newest dateTime in a TimescaleDB table, 0 if it is empty."""
+        conn = self._get_tsdb_conn()
+        cur = conn.cursor()
         try:
-            # Log the keys we're receiving
-            # log.info(f"Record keys for table {table}: {list(record.keys())}")
-            
-            # Create table if it does not exist
-            col_defs = ', '.join([f'{col} DOUBLE PRECISION' if col != 'dateTime' else 'dateTime INTEGER PRIMARY KEY' for col in record.keys()])
-            create_sql = f"CREATE TABLE IF NOT EXISTS {table} ({col_defs})"
-            cur.execute(create_sql)
+            cur.execute(sql.SQL("SELECT max(datetime) FROM {}").format(self._tsdb_identifier(table)))
+            max_dt = cur.fetchone()[0]
+            # An idle open transaction would hold locks on the hypertable and its chunks,
+            # only the daily sync keeps it open because it reads inside its copy transaction
+            if end_transaction:
+                conn.commit()
+        except Exception:
+            self._rollback_tsdb()
+            raise
+        finally:
+            cur.close()
+        return max_dt if max_dt is not None else 0
+
+    def _rollback_tsdb(self):
+        """Roll back the open TimescaleDB transaction and forget the staging tables it may have created."""
+        if self.tsdb_conn is not None and not self.tsdb_conn.closed:
+            self.tsdb_conn.rollback()
+        self._staging_tables.clear()
+
+    def _get_archive_watermark(self):
+        """Return the dateTime up to which the WeeWX archive is in TimescaleDB."""
+        if self._archive_watermark is None:
+            self._archive_watermark = self._get_tsdb_max_datetime("archive")
+        return self._archive_watermark
+
+    @staticmethod
+    def _tsdb_column_def(col):
+        """Column definition of a WeeWX column in TimescaleDB."""
+        if col in TSDB_INTEGER_COLUMNS:
+            return f"{col} INTEGER"
+        if col in TSDB_DOUBLE_COLUMNS:
+            return f"{col} DOUBLE PRECISION"
+        return f"{col} {TSDB_MEASUREMENT_TYPE}"
+
+    def _ensure_tsdb_table(self, cur, table, columns):
+        """Create a TimescaleDB table the first time it is seen, skip the DDL afterwards."""
+        if table in self._ensured_tables:
+            return
+        col_defs = ', '.join([self._tsdb_column_def(col) if col != 'dateTime' else 'dateTime INTEGER PRIMARY KEY' for col in columns])
+        cur.execute(f"CREATE TABLE IF NOT EXISTS {table} ({col_defs})")
+        self.tsdb_conn.commit()
+        self._ensured_tables.add(table)
+
+    def _get_weewx_conn(self):
+        """Return the long-lived WeeWX DB connection of the worker thread."""
+        if self.weewx_conn is None:
+            self.weewx_conn = self._connect_weewx_db()
+        return self.weewx_conn
+
+    def _close_weewx_conn(self):
+        """Close the WeeWX DB connection, called on the worker thread that opened it."""
+        if self.weewx_conn is not None:
+            self.weewx_conn.close()
+            self.weewx_conn = None
+
+    def _connect_weewx_db(self):
+        """Open the WeeWX DB read-only."""
+        # Only connection-local pragmas, the journal mode of the WeeWX database belongs to WeeWX
+        conn = sqlite3.connect(f"file:{urllib.parse.quote(self.weewx_db_path)}?mode=ro", uri=True)
+        conn.execute("PRAGMA query_only=1")
+        conn.execute("PRAGMA cache_size=-65536")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        # Backlog scans read the file through a memory map instead of read() calls
+        conn.execute("PRAGMA mmap_size=268435456")
+        return conn
+
+    def _read_weewx_batches(self, cursor, query, start, dt_pos):
+        """Yield the rows of query after start, each batch read to the end by its own statement."""
+        # A SELECT still open in SQLite holds a SHARED lock that keeps WeeWX from
+        # committing its archive record, no statement stays open across a TimescaleDB load
+        while not self._stop.is_set():
+            cursor.execute(query, (start, FETCH_BATCH_SIZE))
+            rows = cursor.fetchall()
+            if not rows:
+                return
+            yield rows
+            if len(rows) < FETCH_BATCH_SIZE:
+                return
+            start = rows[-1][dt_pos]
+
+    def _get_archive_select_columns(self, cursor):
+        """Return the archive_columns that exist in the WeeWX archive table, in archive_columns order."""
+        if self._archive_select_columns is None:
+            cursor.execute("PRAGMA table_info(archive)")
+            existing = {row[1] for row in cursor.fetchall()}
+            self._archive_select_columns = [col for col in self.archive_columns if col in existing]
+        return self._archive_select_columns
+
+    def _insert_tsdb(self, table, records):
+        """Insert live records with one multi-row INSERT in one transaction."""
+        cur = self._get_tsdb_conn().cursor()
+        try:
+            # Every record is laid out on the columns the backlog copies, a missing
+            # observation becomes NULL, so all records share one statement
+            columns = tuple(self._archive_select_columns or self.archive_columns)
+            values = [tuple(record.get(col) for col in columns) for record in records]
+
+            self._ensure_tsdb_table(cur, table, columns)
+            key = (table, columns)
+            insert_sql = self._insert_sql_cache.get(key)
+            if insert_sql is None:
+                insert_sql = sql.SQL("INSERT INTO {} ({}) VALUES %s ON CONFLICT (datetime) DO NOTHING").format(
+                    self._tsdb_identifier(table), self._tsdb_column_list(columns))
+                self._insert_sql_cache[key] = insert_sql
+            execute_values(cur, insert_sql, values, page_size=WORKER_BATCH_SIZE)
             self.tsdb_conn.commit()
+            log.info(f"Inserted {len(records)} records into TimescaleDB {table} up to time {records[-1].get('dateTime')}")
+        except Exception:
+            self._rollback_tsdb()
+            raise
+        finally:
+            cur.close()
 
-            filtered_columns = [col for col in record.keys() if col in self.archive_columns or col in ['dateTime', 'usUnits', 'interval']]
-            filtered_record = {col: record[col] for col in filtered_columns}
-            columns = ','.join(filtered_record.keys())
-            placeholders = ','.join(['%s'] * len(filtered_record))
-            values = tuple(filtered_record.values())
-            insert_sql = f"INSERT INTO {table} ({columns}) VALUES ({placeholders})"
-            cur.execute(insert_sql, values)
-            self.tsdb_conn.commit()
-            log.info(f"Inserted data into TimescaleDB {table} at time {record.get('dateTime')}")
-        except Exception as e:
-            log.error("Error inserting record into TimescaleDB %s: %s", table, e)
+    @staticmethod
+    def _tsdb_identifier(name):
+        """Quote a WeeWX table or column name the way postgres folds the unquoted name."""
+        return sql.Identifier(name.lower())
+
+    def _tsdb_column_list(self, columns):
+        """Comma separated, quoted column list for a TimescaleDB statement."""
+        return sql.SQL(',').join(self._tsdb_identifier(col) for col in columns)
+
+    def _get_tsdb_column_types(self, cur, table):
+        """Return a dict of lower-case column name to postgres data type for a TimescaleDB table."""
+        if table not in self._tsdb_column_types:
+            cur.execute("SELECT column_name, data_type FROM information_schema.columns "
+                        "WHERE table_schema = 'public' AND table_name = %s", (table.lower(),))
+            self._tsdb_column_types[table] = dict(cur.fetchall())
+        return self._tsdb_column_types[table]
+
+    def _encode_copy_binary(self, types, rows):
+        """Encode rows in the postgres binary COPY format, return None if a type or value is not supported."""
+        try:
+            fields = []
+            for pg_type in types:
+                fmt, convert = PG_BINARY_TYPES[pg_type]
+                fields.append((struct.Struct(f'>i{fmt}').pack, struct.calcsize(f'>{fmt}'), convert))
+            field_count = struct.pack('>h', len(fields))
+            null = struct.pack('>i', -1)
+
+            buf = io.BytesIO()
+            buf.write(PG_COPY_SIGNATURE + struct.pack('>ii', 0, 0))
+            for row in rows:
+                buf.write(field_count)
+                for value, (pack, size, convert) in zip(row, fields):
+                    buf.write(null if value is None else pack(size, convert(value)))
+            buf.write(struct.pack('>h', -1))
+        except (KeyError, ValueError, TypeError, OverflowError, struct.error):
+            return None
+        buf.seek(0)
+        return buf
+
+    def _copy_tsdb(self, table, columns, rows, commit=True, update=False):
+        """Bulk load rows into a TimescaleDB table with a single COPY FROM STDIN."""
+        cur = self._get_tsdb_conn().cursor()
+        try:
+            # Created outside the savepoint of _load_tsdb_rows, rolling back to it must not drop the table
+            if len(rows) >= COPY_MIN_ROWS:
+                self._ensure_staging_table(cur, table)
+            loaded, load_format = self._load_tsdb_rows(cur, table, columns, rows, update)
+            # With commit=False the caller commits several copies in one transaction
+            if commit:
+                self.tsdb_conn.commit()
+            log.info(f"Loaded {loaded} of {len(rows)} records into TimescaleDB {table} ({load_format})")
+        except Exception:
+            # A rollback also drops staging tables created in the same transaction
+            self._rollback_tsdb()
+            raise
         finally:
             cur.close()
 
+    def _load_tsdb_rows(self, cur, table, columns, rows, update):
+        """Load rows under a savepoint, a batch rejected for its data is split until the bad rows are found."""
+        cur.execute("SAVEPOINT tsdb_load")
+        try:
+            load_format = self._load_tsdb_batch(cur, table, columns, rows, update)
+            loaded = len(rows)
+        except (psycopg2.DataError, psycopg2.IntegrityError) as e:
+            cur.execute("ROLLBACK TO SAVEPOINT tsdb_load")
+            if len(rows) == 1:
+                # One bad record must not stop the sync, it is skipped like the baseline did
+                log.error(f"Skipping record {rows[0][columns.index('dateTime')]} for TimescaleDB {table}: {e}")
+                return 0, 'skipped'
+            half = len(rows) // 2
+            loaded, load_format = self._load_tsdb_rows(cur, table, columns, rows[:half], update)
+            loaded += self._load_tsdb_rows(cur, table, columns, rows[half:], update)[0]
+        cur.execute("RELEASE SAVEPOINT tsdb_load")
+        return loaded, load_format
+
+    def _load_tsdb_batch(self, cur, table, columns, rows, update):
+        """Send one batch with a multi-row INSERT or a COPY through the staging table, return the format used."""
+        # The steady state is one new record per pass, COPY through the staging
+        # table would cost three extra statements for it
+        if len(rows) < COPY_MIN_ROWS:
+            execute_values(cur, self._get_upsert_sql(table, columns, update, staged=False), rows,
+                           page_size=COPY_MIN_ROWS)
+            return 'VALUES'
+        # COPY has no ON CONFLICT clause, rows are copied into a staging table and moved
+        # with one INSERT ... SELECT that skips, or with update=True overwrites, existing rows
+        staging = self._ensure_staging_table(cur, table)
+        # Binary COPY skips text parsing on the server and sends fewer bytes,
+        # CSV is the fallback for column types or values it cannot encode
+        column_types = self._get_tsdb_column_types(cur, table)
+        buf = self._encode_copy_binary([column_types.get(col.lower()) for col in columns], rows)
+        if buf is not None:
+            copy_format = 'BINARY'
+        else:
+            buf = io.StringIO()
+            csv.writer(buf).writerows(rows)
+            buf.seek(0)
+            copy_format = 'CSV'
+        key = (table, tuple(columns), copy_format)
+        copy_sql = self._copy_sql_cache.get(key)
+        if copy_sql is None:
+            copy_sql = sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT {})").format(
+                staging, self._tsdb_column_list(columns), sql.SQL(copy_format))
+            self._copy_sql_cache[key] = copy_sql
+        cur.copy_expert(copy_sql, buf)
+        cur.execute(self._get_upsert_sql(table, columns, update))
+        cur.execute(sql.SQL("TRUNCATE {}").format(staging))
+        return copy_format
+
+    def _ensure_staging_table(self, cur, table):
+        """Create the temporary staging table of a TimescaleDB table once per connection."""
+        staging = self._tsdb_identifier(f"{table}_staging")
+        if table not in self._staging_tables:
+            cur.execute(sql.SQL("CREATE TEMP TABLE IF NOT EXISTS {} (LIKE {} INCLUDING DEFAULTS)").format(
+                staging, self._tsdb_identifier(table)))
+            self._staging_tables.add(table)
+        return staging
+
+    def _get_upsert_sql(self, table, columns, update, staged=True):
+        """INSERT moving staged rows, or with staged=False a VALUES list, into a TimescaleDB table."""
+        key = (table, tuple(columns), update, staged)
+        upsert_sql = self._upsert_sql_cache.get(key)
+        if upsert_sql is None:
+            if update:
+                action = sql.SQL("DO UPDATE SET {}").format(sql.SQL(',').join(
+                    sql.SQL("{0} = EXCLUDED.{0}").format(self._tsdb_identifier(col))
+                    for col in columns if col != 'dateTime'))
+            else:
+                action = sql.SQL("DO NOTHING")
+            column_list = self._tsdb_column_list(columns)
+            if staged:
+                source = sql.SQL("SELECT {} FROM {}").format(column_list, self._tsdb_identifier(f"{table}_staging"))
+            else:
+                source = sql.SQL("VALUES %s")
+            upsert_sql = sql.SQL("INSERT INTO {} ({}) {} ON CONFLICT (datetime) {}").format(
+                self._tsdb_identifier(table), column_list, source, action)
+            self._upsert_sql_cache[key] = upsert_sql
+        return upsert_sql
+
     def _sync_daily_archives(self):
         """Synchronize daily archives from WeeWX to TimescaleDB."""
-        for measurements in self.daily_archive_tables:
-            try:
-                self.weewx_conn = sqlite3.connect(self.weewx_db_path)
-                cursor = self.weewx_conn.cursor()
-
-                # Attach sync database
-                cursor.execute(f"ATTACH DATABASE '{self.sync_db_path}' AS sync_db")
-
-                # Select records not in synced_archive_day
-                cursor.execute(f"""
-                    SELECT * FROM {measurements} 
-                    WHERE dateTime NOT IN (SELECT dateTime FROM sync_db.synced_archive_day WHERE synced = 1)
-                    ORDER BY dateTime ASC
-                """)
-                rows = cursor.fetchall()
-
-                if rows:
-                    columns = [description[0] for description in cursor.description]
-
-                    try:
-                        self.tsdb_conn = psycopg2.connect(**self.tsdb_config)
-                        sconn = sqlite3.connect(self.sync_db_path)
-                        scur = sconn.cursor()
-                        for row in rows:
-                            daily_record = dict(zip(columns, row))
-                            dt = daily_record['dateTime']
-                            
-                            try:
-                                self._insert_tsdb(measurements, daily_record)
-                                # Mark day as synced
-                                scur.execute("INSERT OR REPLACE INTO synced_archive_day (dateTime, synced) VALUES (?, 1)", (dt,))
-                            except Exception as e:
-                                log.error(f"Error syncing daily record {dt} from {measurements}: {e}")
-                        
-                        sconn.commit()
-                        scur.close()
-                        sconn.close()
-                    except Exception as e:
-                        log.error(f"Error during batch sync for {measurements}: {e}")
-                    finally:
-                        if hasattr(self, 'tsdb_conn'):
-                            self.tsdb_conn.close()
-
-            except Exception as e:
-                log.error(f"Error synchronizing daily archives from {measurements}: {e}")
-            finally:
-                if hasattr(self, 'weewx_conn'):
-                    self.weewx_conn.close()
-
-    def _init_sync_db(self):
-        """Create the sync DB file and required tables if they do not exist."""
+        # All daily tables are copied in one TimescaleDB transaction, the watermarks
+        # move once it has been committed
+        watermarks = {}
+        columns = self.daily_archive_columns
+        dt_pos = columns.index('dateTime')
+        cursor = None
         try:
-            # Create sync database if it does not exist
-            db_dir = os.path.dirname(self.sync_db_path)
-            if db_dir and not os.path.exists(db_dir):
-                os.makedirs(db_dir, exist_ok=True)
-            conn = sqlite3.connect(self.sync_db_path)
-            cur = conn.cursor()
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS synced_archive (
-                    dateTime INTEGER PRIMARY KEY,
-                    synced INTEGER DEFAULT 0
-                )
-            """)
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS synced_archive_day (
-                    dateTime INTEGER PRIMARY KEY,
-                    synced INTEGER DEFAULT 0
-                )
-            """)
-            conn.commit()
-            cur.close()
-            conn.close()
-            log.info("Synchronization database at %s", self.sync_db_path)
+            self._get_tsdb_conn()
+            cursor = self._get_weewx_conn().cursor()
+
+            for measurements in self.daily_archive_tables:
+                if self._stop.is_set():
+                    break
+                watermark = self._daily_watermarks.get(measurements)
+                if watermark is None:
+                    watermark = self._get_tsdb_max_datetime(measurements, end_transaction=False)
+                    self._daily_watermarks[measurements] = watermark
+                # WeeWX keeps updating the summary of the current day, the watermark
+                # day is read again and overwrites the row in TimescaleDB; dateTime is
+                # in whole seconds, so the first batch starts one second before it
+                batches = self._read_weewx_batches(cursor, self._daily_select_sql[measurements], watermark - 1, dt_pos)
+                try:
+                    for rows in batches:
+                        self._copy_tsdb(measurements, columns, rows, commit=False, update=True)
+                        watermarks[measurements] = rows[-1][dt_pos]
+                except sqlite3.Error as e:
+                    log.error(f"Error reading daily archives from {measurements}: {e}")
+
+            self._get_tsdb_conn().commit()
+            self._daily_watermarks.update(watermarks)
         except Exception as e:
-            log.error("Failed to ensure sync DB/tables: %s", e)
-        
+            self._rollback_tsdb()
+            log.error(f"Error synchronizing daily archives: {e}")
+        finally:
+            if cursor is not None:
+                cursor.close()
+
+    def _init_tsdb(self):
+        """Create the TimescaleDB database and tables if they do not exist."""
         # Create postgres TimescaleDB database with archive and daily_archive_xxx if it does not exist
+        tsdb_conn = None
+        locked = False
         try:
             tsdb_conn = psycopg2.connect(host=self.host, port=self.port, user=self.user, password=self.password)
             tsdb_conn.autocommit = True
@@ -279,8 +618,11 @@ class TimescaleDBSync(StdService):
             tsdb_cur.execute(f"SELECT 1 FROM pg_database WHERE datname = %s", (self.database,))
             db_exists = tsdb_cur.fetchone()
             if not db_exists:
-                tsdb_cur.execute(f"CREATE DATABASE {self.database}")
-                log.info(f"Created TimescaleDB database {self.database}")
+                try:
+                    tsdb_cur.execute(sql.SQL("CREATE DATABASE {}").format(sql.Identifier(self.database)))
+                    log.info(f"Created TimescaleDB database {self.database}")
+                except psycopg2.errors.DuplicateDatabase:
+                    pass  # Created by another instance since the check
             
             # Close connection to postgres db and connect to our database
             tsdb_cur.close()
@@ -291,6 +633,11 @@ class TimescaleDBSync(StdService):
                                        password=self.password, database=self.database)
             tsdb_conn.autocommit = True
             tsdb_cur = tsdb_conn.cursor()
+
+            # Instances starting at the same time run the schema setup one after another,
+            # the lock is released by pg_advisory_unlock or when the session ends
+            tsdb_cur.execute("SELECT pg_advisory_lock(%s)", (TSDB_INIT_LOCK_ID,))
+            locked = True
             
             # Enable TimescaleDB extension in our database
             tsdb_cur.execute("CREATE EXTENSION IF NOT EXISTS timescaledb")
@@ -311,53 +658,167 @@ class TimescaleDBSync(StdService):
                 """)
                 tsdb_conn.commit()
                 
-                # Convert to hypertable tables
+                # Convert to hypertable tables, the unique dateTime index replaces the default time index
                 try:
-                    tsdb_cur.execute("SELECT create_hypertable('archive', 'datetime', if_not_exists => TRUE, chunk_time_interval => 86400)")
+                    tsdb_cur.execute("SELECT create_hypertable('archive', 'datetime', if_not_exists => TRUE, chunk_time_interval => %s, create_default_indexes => FALSE)",
+                                     (TSDB_ARCHIVE_CHUNK_INTERVAL,))
                     tsdb_conn.commit()
                     log.info(f"Created hypertable archive")
                 except Exception as e:
                     log.error(f"Error converting archive table to hypertable: {e}")
 
-                # Add remaining columns from self.archive_columns
-                for column in self.archive_columns:
-                    if column in ['datetime', 'usunits', 'interval']:
-                        continue  # Skip columns we already created
-                    try:
-                        tsdb_cur.execute(f"ALTER TABLE archive ADD COLUMN IF NOT EXISTS {column} DOUBLE PRECISION")
-                        tsdb_conn.commit()
-                    except Exception as e:
-                        log.error(f"Error adding column {column} to archive table: {e}")
-
                 # Create and convert daily summary tables
+                daily_col_defs = ', '.join(self._tsdb_column_def(col) for col in self.daily_archive_columns)
                 for table in self.daily_archive_tables:
                     try:
                         # Create table
-                        tsdb_cur.execute(f"""
-                            CREATE TABLE IF NOT EXISTS {table} (
-                                datetime INTEGER,
-                                min DOUBLE PRECISION,
-                                mintime INTEGER,
-                                max DOUBLE PRECISION,
-                                maxtime INTEGER,
-                                sum DOUBLE PRECISION,
-                                count INTEGER,
-                                wsum DOUBLE PRECISION,
-                                sumtime INTEGER
-                            )
-                        """)
+                        tsdb_cur.execute(f"CREATE TABLE IF NOT EXISTS {table} ({daily_col_defs})")
 
                         # Convert to hypertable
-                        tsdb_cur.execute(f"SELECT create_hypertable('{table}', 'datetime', if_not_exists => TRUE, chunk_time_interval => 86400)")
+                        tsdb_cur.execute(f"SELECT create_hypertable('{table}', 'datetime', if_not_exists => TRUE, chunk_time_interval => %s, create_default_indexes => FALSE)",
+                                         (TSDB_DAILY_CHUNK_INTERVAL,))
                         log.info(f"Created hypertable {table}")
                     except Exception as e:
                         log.error(f"Error creating hypertable {table} failed: {e}")
 
-            tsdb_cur.close()
-            tsdb_conn.close()
+            # Add the columns of self.archive_columns the archive table lacks in one ALTER TABLE,
+            # so columns added to ARCHIVE_COLUMNS later also reach an existing table; with none
+            # missing the ALTER and its ACCESS EXCLUSIVE lock on the hypertable are skipped
+            try:
+                tsdb_cur.execute("SELECT column_name FROM information_schema.columns WHERE table_schema = 'public' AND table_name = 'archive'")
+                existing = {row[0] for row in tsdb_cur.fetchall()}
+                missing = [column for column in self.archive_columns if column.lower() not in existing]
+                if missing:
+                    add_columns = ', '.join(f"ADD COLUMN IF NOT EXISTS {self._tsdb_column_def(column)}" for column in missing)
+                    tsdb_cur.execute(f"ALTER TABLE archive {add_columns}")
+                    log.info(f"Added {len(missing)} columns to archive table")
+            except Exception as e:
+                log.error(f"Error adding columns to archive table: {e}")
+
+            # ON CONFLICT (datetime) needs a unique index, databases created by older versions lack it
+            for table in ["archive", *self.daily_archive_tables]:
+                self._ensure_unique_datetime(tsdb_cur, table)
+
+            if self.compress_after_days > 0:
+                self._init_compression(tsdb_cur)
+
+            if self.enable_continuous_aggregates:
+                self._init_continuous_aggregates(tsdb_cur)
+
+            # The insert path does not need to issue DDL for the tables created here
+            self._ensured_tables.update(["archive", *self.daily_archive_tables])
+
             log.info("Completed TimescaleDB initialization")
         except Exception as e:
             log.error(f"Failed to initialize TimescaleDB database: {e}")
+        finally:
+            # Also after a failed setup, the lock is not left to the end of a forgotten session
+            if tsdb_conn is not None and not tsdb_conn.closed:
+                try:
+                    if locked:
+                        tsdb_conn.cursor().execute("SELECT pg_advisory_unlock(%s)", (TSDB_INIT_LOCK_ID,))
+                except psycopg2.Error as e:
+                    log.error(f"Error releasing the TimescaleDB setup lock: {e}")
+                finally:
+                    tsdb_conn.close()
+
+    def _ensure_unique_datetime(self, tsdb_cur, table):
+        """Create the unique dateTime index of a TimescaleDB table, dropping duplicate rows first."""
+        index = f"{table.lower()}_datetime_key"
+        try:
+            tsdb_cur.execute("SELECT 1 FROM pg_indexes WHERE schemaname = 'public' AND indexname = %s", (index,))
+            if tsdb_cur.fetchone():
+                return
+            # Rows with the same dateTime always land in the same chunk, so ctid tells them apart
+            tsdb_cur.execute(f"DELETE FROM {table} a USING {table} b WHERE a.datetime = b.datetime AND a.ctid < b.ctid")
+            if tsdb_cur.rowcount:
+                log.info(f"Removed {tsdb_cur.rowcount} duplicate rows from {table}")
+            tsdb_cur.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {index} ON {table} (datetime)")
+            log.info(f"Created unique index {index}")
+        except Exception as e:
+            log.error(f"Error creating unique index on {table}: {e}")
+
+    def _init_integer_now(self, tsdb_cur):
+        """Register the current unix time as 'now' of the archive hypertable."""
+        # Policies on an integer time column need a function returning the current time in that unit
+        tsdb_cur.execute("""
+            CREATE OR REPLACE FUNCTION tsdb_unix_now() RETURNS INTEGER
+            LANGUAGE SQL STABLE AS $$ SELECT extract(epoch FROM now())::INTEGER $$
+        """)
+        tsdb_cur.execute("SELECT set_integer_now_func('archive', 'tsdb_unix_now', replace_if_exists => TRUE)")
+
+    def _init_compression(self, tsdb_cur):
+        """Enable native compression of the archive hypertable with a policy for older chunks."""
+        try:
+            self._init_integer_now(tsdb_cur)
+            tsdb_cur.execute("SELECT compression_enabled FROM timescaledb_information.hypertables "
+                             "WHERE hypertable_name = 'archive'")
+            row = tsdb_cur.fetchone()
+            if row is not None and not row[0]:
+                tsdb_cur.execute("ALTER TABLE archive SET (timescaledb.compress, timescaledb.compress_orderby = 'datetime DESC')")
+            tsdb_cur.execute("SELECT add_compression_policy('archive', compress_after => %s, if_not_exists => TRUE)",
+                             (self.compress_after_days * 86400,))
+            log.info(f"Compressing archive chunks older than {self.compress_after_days} days")
+        except Exception as e:
+            log.error(f"Error enabling compression of the archive table: {e}")
+
+    def _init_continuous_aggregates(self, tsdb_cur):
+        """Create continuous aggregates with daily summaries of the archive hypertable."""
+        self._init_integer_now(tsdb_cur)
+
+        # Days are bucketed on UTC midnight, the WeeWX daily summaries use local midnight
+        for view, obs in self.continuous_aggregates.items():
+            try:
+                tsdb_cur.execute(f"""
+                    CREATE MATERIALIZED VIEW IF NOT EXISTS {view}
+                    WITH (timescaledb.continuous) AS
+                    SELECT time_bucket(86400, datetime) AS datetime,
+                           min({obs}) AS min,
+                           max({obs}) AS max,
+                           sum({obs}) AS sum,
+                           count({obs}) AS count,
+                           sum({obs} * interval * 60) AS wsum,
+                           sum(CASE WHEN {obs} IS NOT NULL THEN interval * 60 END) AS sumtime
+                    FROM archive
+                    GROUP BY 1
+                    WITH NO DATA
+                """)
+                tsdb_cur.execute(f"""
+                    SELECT add_continuous_aggregate_policy('{view}',
+                        start_offset => {CAGG_START_OFFSET}, end_offset => 3600,
+                        schedule_interval => INTERVAL '{CAGG_SCHEDULE_INTERVAL} seconds', if_not_exists => TRUE)
+                """)
+                log.info(f"Created continuous aggregate {view}")
+            except Exception as e:
+                log.error(f"Error creating continuous aggregate {view}: {e}")
+
+    def _refresh_pending_aggregates(self):
+        """Refresh the continuous aggregates for copied data older than the policy window."""
+        # The policy refreshes the last CAGG_START_OFFSET seconds every CAGG_SCHEDULE_INTERVAL,
+        # only older data needs an explicit refresh
+        start = self._cagg_refresh_start
+        if start < time.time() - CAGG_START_OFFSET + CAGG_SCHEDULE_INTERVAL:
+            if not self._refresh_continuous_aggregates(start):
+                return  # retried on the next pass
+        self._cagg_refresh_start = None
+
+    def _refresh_continuous_aggregates(self, start):
+        """Materialize the continuous aggregates from the day of start on, return True on success."""
+        conn = self._get_tsdb_conn()
+        cur = conn.cursor()
+        try:
+            # refresh_continuous_aggregate() cannot run inside a transaction block
+            conn.autocommit = True
+            for view in self.continuous_aggregates:
+                cur.execute("CALL refresh_continuous_aggregate(%s, %s, NULL)", (view, start - start % 86400))
+        except Exception as e:
+            log.error(f"Error refreshing continuous aggregates: {e}")
+            return False
+        finally:
+            cur.close()
+            if not conn.closed:
+                conn.autocommit = False
+        return True
 
 if __name__ == "__main__":
     """This section is used to test tsdb.py."""
@@ -417,3 +878,6 @@ if __name__ == "__main__":
 
     # Use it to trigger the sync:
     sync.new_archive_record(event)
+
+    # Wait for the worker thread to process the record
+    sync.shutDown()